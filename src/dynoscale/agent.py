@@ -1,15 +1,31 @@
+import asyncio
 import logging
+import multiprocessing
 import os
+import random
 from enum import Enum
+from typing import Optional, Dict
 
-from dynoscale.const.env import ENV_DEV_MODE, ENV_DYNOSCALE_URL
+from dynoscale.const.env import ENV_DEV_MODE, ENV_DYNOSCALE_URL, ENV_WORKERS_AUTOSCALE, ENV_WORKERS_MIN, \
+    ENV_WORKERS_MAX, ENV_WORKERS_MEMORY_LIMIT_MB, ENV_SHED_DEADLINE_MS, ENV_SHED_RETRY_AFTER, ENV_SHED_EXEMPT_PATHS, \
+    ENV_LOOP_LAG_SAMPLER, ENV_LOOP_LAG_INTERVAL_MS
+from dynoscale.lag import LoopLagSampler, AsyncioLoopLagSampler, GeventHubLagSampler, DEFAULT_SECONDS_BETWEEN_SAMPLES
 from dynoscale.const.header import X_REQUEST_START
 from dynoscale.logger import EventLogger
 from dynoscale.reporter import DynoscaleReporter
-from dynoscale.utils import mock_in_heroku_headers, extract_header_value, epoch_ms
+from dynoscale.runtime import RuntimeConfig
+from dynoscale.utils import mock_in_heroku_headers, extract_header_value, epoch_ms, cgroup_memory_limit
+from dynoscale.workers import WorkerScaler, BusyTime, DEFAULT_MEMORY_HEADROOM
+from dynoscale.wsgi import LoadSheddingMiddleware, DEFAULT_SECONDS_OF_RETRY_AFTER
 
 logger = logging.getLogger(__name__)
 
+
+def _worker_class_from(worker, module: str) -> bool:
+    """Whether the worker's class or any of its bases comes from `module` (or its submodules)"""
+    return any(cls.__module__ == module or cls.__module__.startswith(f"{module}.") for cls in type(worker).__mro__)
+
+
 class ConfigMode(Enum):
     PRODUCTION = 1
     DEVELOPMENT = 2
@@ -39,6 +55,7 @@ class DynoscaleAgent:
         elif value is AgentRole.WORKER:
             self.reporter.stop()
             self.reporter = None
+            self.worker_scaler = None
             self.event_logger = EventLogger()
         self._role = value
 
@@ -59,6 +76,13 @@ class DynoscaleAgent:
         self.event_logger: EventLogger = EventLogger()
         # self.uploader: EventUploader = EventUploader(repository=self.repository)
         self.reporter: Optional[DynoscaleReporter] = None
+        self.runtime_config: Optional[RuntimeConfig] = None
+        self.workers_autoscale: bool = False
+        self.worker_scaler: Optional[WorkerScaler] = None
+        self.busy_time: Optional[BusyTime] = None
+        self.requests_in_flight: Dict[int, int] = {}
+        self.loop_lag_sampler: Optional[LoopLagSampler] = None
+        self.load_shedding: Optional[LoadSheddingMiddleware] = None
 
     def __new__(cls):
         """DynoscaleAgent is a singleton, it will be created on first call and then same instance returned afterwards"""
@@ -69,6 +93,13 @@ class DynoscaleAgent:
             i.logger.debug(f"__new__")
             # TODO: if env['DYNO'] isn't dyno.1 then don't upload or log anything, basically remove itself.
             i._role = AgentRole.SERVER
+            i.runtime_config = None
+            i.workers_autoscale = False
+            i.worker_scaler = None
+            i.busy_time = None
+            i.requests_in_flight = {}
+            i.loop_lag_sampler = None
+            i.load_shedding = None
             # Store it to class
             cls._instance = i
         # Return the one and only (per process)
@@ -81,8 +112,33 @@ class DynoscaleAgent:
         self.logger.debug(f"_load_config SUCCESS mode: {self.mode.name}")
         # TODO: What happens when unsuccessful?
 
+        self.workers_autoscale = bool(os.environ.get(ENV_WORKERS_AUTOSCALE))
+        # Workers forked after this point share it with the master
+        self.busy_time = BusyTime() if self.workers_autoscale else None
+
         self.event_logger = EventLogger()
         self.reporter = DynoscaleReporter(api_url=self.api_url, autostart=True)
+        # Workers forked after this point share it with the master
+        self.runtime_config = self.reporter.runtime_config
+
+    def start_worker_scaler(self, server):
+        """Starts adjusting the number of gunicorn workers on its own thread, runs on server (main) only"""
+        self.logger.debug(f"start_worker_scaler")
+        memory_limit_mb = os.environ.get(ENV_WORKERS_MEMORY_LIMIT_MB)
+        if memory_limit_mb:
+            memory_limit = int(memory_limit_mb) * 1024 * 1024
+        else:
+            cgroup_limit = cgroup_memory_limit()
+            memory_limit = int(cgroup_limit * DEFAULT_MEMORY_HEADROOM) if cgroup_limit else None
+        self.worker_scaler = WorkerScaler(
+            server=server,
+            min_workers=int(os.environ.get(ENV_WORKERS_MIN, 1)),
+            max_workers=int(os.environ.get(ENV_WORKERS_MAX, multiprocessing.cpu_count() * 2 + 1)),
+            memory_limit=memory_limit,
+            busy_time=self.busy_time,
+            runtime_config=self.runtime_config,
+        )
+        self.worker_scaler.start()
 
     # Hook methods listed in order of execution
     # STARTUP: nworkers_changed, on_starting, when_ready, pre_fork (* workers) - up to here runs on server (main)
@@ -92,6 +148,8 @@ class DynoscaleAgent:
     # on_reload, pre_exec, worker_abort are special :)
     def nworkers_changed(self, server, new_value, old_value):
         self.logger.debug(f"nworkers_changed (s:{id(server)} {old_value}->{new_value})")
+        if self.worker_scaler:
+            self.worker_scaler.on_workers_changed(new_value)
 
     def on_starting(self, server):
         self.logger.debug(f"on_starting (s:{id(server)} s.pid{server.pid})")
@@ -99,6 +157,8 @@ class DynoscaleAgent:
     def when_ready(self, server):
         self.logger.debug(f"when_ready (s:{id(server)} s.pid{server.pid})")
         self.config()
+        if self.workers_autoscale:
+            self.start_worker_scaler(server)
 
     def pre_fork(self, server, worker):
         self.logger.debug(f"pre_fork (s:{id(server)} s.pid{server.pid} w:{id(worker)} w.pid{worker.pid})")
@@ -111,32 +171,104 @@ class DynoscaleAgent:
 
     def post_worker_init(self, worker):
         self.logger.debug(f"post_worker_init (w:{id(worker)} w.pid{worker.pid})")
+        shed_deadline = os.environ.get(ENV_SHED_DEADLINE_MS)
+        if shed_deadline:
+            self.install_load_shedding(worker, int(shed_deadline))
+        if os.environ.get(ENV_LOOP_LAG_SAMPLER):
+            self.install_loop_lag_sampler(worker)
+
+    def install_load_shedding(self, worker, deadline: int):
+        """Wraps the worker's app so that requests which queued for longer than `deadline` ms get 503 right away"""
+        # ASGI workers (uvicorn) keep an ASGI app in worker.wsgi, WSGI middleware can't wrap it
+        if type(worker).__module__.startswith('uvicorn'):
+            self.logger.warning(f"install_load_shedding - not supported by {type(worker).__name__}, skipping")
+            return
+        exempt_paths = os.environ.get(ENV_SHED_EXEMPT_PATHS, '')
+        self.load_shedding = LoadSheddingMiddleware(
+            worker.wsgi,
+            deadline=deadline,
+            retry_after=int(os.environ.get(ENV_SHED_RETRY_AFTER, DEFAULT_SECONDS_OF_RETRY_AFTER)),
+            exempt_paths=[path.strip() for path in exempt_paths.split(',') if path.strip()],
+            on_shed=self.event_logger.on_requests_shed,
+        )
+        worker.wsgi = self.load_shedding
+
+    def install_loop_lag_sampler(self, worker):
+        """Starts sampling the lag of the worker's event loop, gevent and uvicorn workers only"""
+        interval_ms = os.environ.get(ENV_LOOP_LAG_INTERVAL_MS)
+        interval = int(interval_ms) / 1_000 if interval_ms else DEFAULT_SECONDS_BETWEEN_SAMPLES
+        on_window = self.event_logger.on_loop_lag
+        if _worker_class_from(worker, 'gunicorn.workers.ggevent'):
+            import gevent
+            self.loop_lag_sampler = GeventHubLagSampler(gevent.get_hub(), on_window, interval=interval)
+            self.loop_lag_sampler.start()
+        elif _worker_class_from(worker, 'uvicorn'):
+            # UvicornWorker only creates its loop in run(), which comes after this hook, so start once it's running
+            serve = getattr(worker, '_serve', None)
+            if serve is None:
+                self.logger.warning(f"install_loop_lag_sampler - unsupported {type(worker).__name__} version, skipping")
+                return
+
+            async def _serve(*args, **kwargs):
+                self.loop_lag_sampler = AsyncioLoopLagSampler(
+                    asyncio.get_running_loop(), on_window, interval=interval
+                )
+                self.loop_lag_sampler.start()
+                return await serve(*args, **kwargs)
+
+            worker._serve = _serve
+        else:
+            self.logger.warning(f"install_loop_lag_sampler - {type(worker).__name__} has no event loop, skipping")
 
     def pre_request(self, worker, req):
         self.logger.debug(f"pre_request (w:{id(worker)} w.pid{worker.pid} rq:{id(req)})")
         req_received = epoch_ms()
+        if self.busy_time:
+            # Busy time is tracked for every request, it's cheap and sampling would hide saturation
+            self.requests_in_flight[id(req)] = req_received
+            self.busy_time.start(req_received)
+        if self.runtime_config:
+            self.runtime_config.refresh()
+            sample_rate = self.runtime_config.sample_rate
+            if sample_rate < 1 and random.random() >= sample_rate:
+                return
         if self.mode is ConfigMode.DEVELOPMENT:
             mock_in_heroku_headers(req)
         x_request_start = extract_header_value(req, X_REQUEST_START)
         if x_request_start is not None:
             req_queue_time: int = req_received - int(x_request_start)
-            self.event_logger.on_request_received(int(req_received / 1_000), req_queue_time)
+            self.event_logger.on_request_received(int(req_received / 1_000), req_queue_time, self.workers_autoscale)
 
     def post_request(self, worker, req, environ, resp):
         self.logger.debug(
             f"post_request (w:{id(worker)} w.pid{worker.pid} rq:{id(req)} e:{id(environ)} rs:{id(resp)})")
+        req_received = self.requests_in_flight.pop(id(req), None)
+        if req_received is not None:
+            self.busy_time.end(req_received, epoch_ms())
+
+    def end_requests_in_flight(self):
+        """Stops counting busy time of requests this worker won't finish"""
+        now = epoch_ms()
+        while self.requests_in_flight:
+            _, req_received = self.requests_in_flight.popitem()
+            self.busy_time.end(req_received, now)
 
     def worker_int(self, worker):
         self.logger.debug(f"worker_int (w:{id(worker)} w.pid{worker.pid})")
 
     def worker_exit(self, server, worker):
         self.logger.debug(f"worker_exit (s:{id(server)} s.pid{server.pid} w:{id(worker)} w.pid{worker.pid})")
+        if self.load_shedding:
+            self.load_shedding.flush()
+        self.end_requests_in_flight()
 
     def child_exit(self, server, worker):
         self.logger.debug(f"child_exit (s:{id(server)} s.pid{server.pid} w:{id(worker)} w.pid{worker.pid})")
 
     def on_exit(self, server):
         self.logger.debug(f"on_exit (s:{id(server)} s.pid{server.pid})")
+        if self.worker_scaler:
+            self.worker_scaler.stop()
         self.reporter.stop()
 
     def on_reload(self, server):
@@ -144,6 +276,7 @@ class DynoscaleAgent:
 
     def worker_abort(self, worker):
         self.logger.debug(f"worker_abort (w:{id(worker)} w.pid{worker.pid})")
+        self.end_requests_in_flight()
 
     def pre_exec(self, server):
         self.logger.debug(f"pre_exec ( s:{id(server)} s.pid{server.pid})")
@@ -1,3 +1,12 @@
 ENV_DEV_MODE = 'DYNOSCALE_DEV_MODE'
 ENV_HEROKU_DYNO = "DYNO"
 ENV_DYNOSCALE_URL = "DYNOSCALE_URL"
+ENV_WORKERS_AUTOSCALE = "DYNOSCALE_WORKERS_AUTOSCALE"
+ENV_WORKERS_MIN = "DYNOSCALE_WORKERS_MIN"
+ENV_WORKERS_MAX = "DYNOSCALE_WORKERS_MAX"
+ENV_WORKERS_MEMORY_LIMIT_MB = "DYNOSCALE_WORKERS_MEMORY_LIMIT_MB"
+ENV_SHED_DEADLINE_MS = "DYNOSCALE_SHED_DEADLINE_MS"
+ENV_SHED_RETRY_AFTER = "DYNOSCALE_SHED_RETRY_AFTER"
+ENV_SHED_EXEMPT_PATHS = "DYNOSCALE_SHED_EXEMPT_PATHS"
+ENV_LOOP_LAG_SAMPLER = "DYNOSCALE_LOOP_LAG_SAMPLER"
+ENV_LOOP_LAG_INTERVAL_MS = "DYNOSCALE_LOOP_LAG_INTERVAL_MS"
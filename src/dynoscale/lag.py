@@ -0,0 +1,111 @@
+import logging
+import math
+import time
+from typing import Callable, List
+
+from dynoscale.utils import epoch_s
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SECONDS_BETWEEN_SAMPLES = 0.1
+DEFAULT_SECONDS_OF_WINDOW = 30
+
+LOOP_LAG_LOG_SOURCE = "loop_lag"
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of already sorted values"""
+    return sorted_values[max(math.ceil(fraction * len(sorted_values)) - 1, 0)]
+
+
+class LoopLagSampler:
+    """Measures how late a periodic callback runs on a worker's event loop, i.e. how long the loop was blocked.
+
+    Subclasses schedule `sample` once every `interval` seconds on their loop. At the end of every `window` the p50,
+    p99 and max lag in ms are handed to `on_window` (timestamp, p50, p99, max)."""
+
+    def __init__(
+            self,
+            on_window: Callable[[int, int, int, int], None],
+            interval: float = DEFAULT_SECONDS_BETWEEN_SAMPLES,
+            window: float = DEFAULT_SECONDS_OF_WINDOW,
+    ):
+        self.logger: logging.Logger = logging.getLogger(f"{logger.name}.{type(self).__name__}")
+        self.logger.debug(f"__init__")
+        self.on_window = on_window
+        self.interval = interval
+        self.window = window
+
+        self._lags: List[float] = []
+        self._expected: float = 0
+        self._window_end: float = 0
+
+    def _reset(self, now: float):
+        self._expected = now + self.interval
+        self._window_end = now + self.window
+
+    def sample(self, now: float):
+        self._lags.append(max(now - self._expected, 0))
+        self._expected = now + self.interval
+        if now >= self._window_end:
+            self._flush()
+            self._window_end = now + self.window
+
+    def _flush(self):
+        if not self._lags:
+            return
+        lags = sorted(self._lags)
+        self._lags = []
+        p50, p99, maximum = (int(lag * 1_000) for lag in (percentile(lags, .5), percentile(lags, .99), lags[-1]))
+        self.logger.debug(f"_flush - p50:{p50}ms p99:{p99}ms max:{maximum}ms over {len(lags)} samples")
+        self.on_window(epoch_s(), p50, p99, maximum)
+
+
+class AsyncioLoopLagSampler(LoopLagSampler):
+    """Samples lag of an asyncio loop, has to be started from the loop's thread"""
+
+    def __init__(self, loop, on_window: Callable[[int, int, int, int], None], **kwargs):
+        super().__init__(on_window, **kwargs)
+        self.loop = loop
+        self._handle = None
+
+    def start(self):
+        self.logger.debug(f"start")
+        self._reset(self.loop.time())
+        self._handle = self.loop.call_later(self.interval, self._tick)
+
+    def stop(self):
+        self.logger.debug(f"stop")
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+
+    def _tick(self):
+        self.sample(self.loop.time())
+        self._handle = self.loop.call_later(self.interval, self._tick)
+
+
+class GeventHubLagSampler(LoopLagSampler):
+    """Samples lag of the gevent hub's loop with a single repeating timer"""
+
+    def __init__(self, hub, on_window: Callable[[int, int, int, int], None], **kwargs):
+        super().__init__(on_window, **kwargs)
+        self.hub = hub
+        self._timer = None
+
+    def start(self):
+        self.logger.debug(f"start")
+        self._reset(time.monotonic())
+        # Unreferenced, so the timer never keeps the hub alive after the worker's server stops
+        self._timer = self.hub.loop.timer(self.interval, self.interval, ref=False)
+        self._timer.start(self._tick)
+
+    def stop(self):
+        self.logger.debug(f"stop")
+        if self._timer:
+            self._timer.stop()
+            self._timer = None
+
+    def _tick(self):
+        # The hub's own clock is cached per loop iteration, so it can't see how long the iteration took
+        self.sample(time.monotonic())
@@ -4,6 +4,8 @@ import sqlite3
 from typing import Tuple, Iterable
 
 from dynoscale.const.env import ENV_HEROKU_DYNO
+from dynoscale.lag import LOOP_LAG_LOG_SOURCE
+from dynoscale.wsgi import SHED_LOG_SOURCE
 
 logger = logging.getLogger(__name__)
 
@@ -20,9 +22,19 @@ class EventLogger:
         self.heroku_dyno = os.environ.get(ENV_HEROKU_DYNO)
         # TODO: Here we should create a queue and spin up a thread
 
-    def on_request_received(self, timestamp: int, queue_time: int):
+    def on_request_received(self, timestamp: int, queue_time: int, keep_local: bool = False):
         self.logger.debug(f"on_request_received")
-        self.repository.add_queue_time(timestamp, queue_time)
+        self.repository.add_queue_time(timestamp, queue_time, keep_local)
+
+    def on_requests_shed(self, timestamp: int, count: int):
+        self.logger.debug(f"on_requests_shed")
+        self.repository.add_log(timestamp, count, SHED_LOG_SOURCE)
+
+    def on_loop_lag(self, timestamp: int, p50: int, p99: int, maximum: int):
+        self.logger.debug(f"on_loop_lag")
+        self.repository.add_log(timestamp, p50, LOOP_LAG_LOG_SOURCE, "p50")
+        self.repository.add_log(timestamp, p99, LOOP_LAG_LOG_SOURCE, "p99")
+        self.repository.add_log(timestamp, maximum, LOOP_LAG_LOG_SOURCE, "max")
 
 
 # noinspection SqlNoDataSourceInspection,SqlResolve
@@ -43,18 +55,47 @@ class RequestLogRepository:
                 'CREATE TABLE IF NOT EXISTS logs'
                 '(timestamp INTEGER, metric INTEGER, source STRING, metadata STRING)'
             )
+            # Local copies of queue times for scaling workers, never reported so they outlive reported logs
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS local_queue_times'
+                '(timestamp INTEGER, queue_time INTEGER)'
+            )
 
-    def add_queue_time(self, timestamp: int, queue_time: int):
+    def add_log(self, timestamp: int, metric: int, source: str, metadata: str = ""):
+        self.logger.debug(f"add_log ({timestamp},{metric},{source},{metadata})")
+        with self.conn:
+            self.conn.execute(
+                'INSERT INTO logs (timestamp, metric, source, metadata) VALUES (?,?,?,?)',
+                (timestamp, metric, source, metadata)
+            )
+
+    def add_queue_time(self, timestamp: int, queue_time: int, keep_local: bool = False):
+        """Logs queue time for reporting and, with `keep_local`, also keeps a local copy in the same transaction"""
         self.logger.debug(f"add_queue_time ({timestamp},{queue_time})")
         with self.conn:
             self.conn.execute(
                 'INSERT INTO logs (timestamp, metric, source, metadata) VALUES (?,?,?,?)',
                 (timestamp, queue_time, "web", "")
             )
+            if keep_local:
+                self.conn.execute(
+                    'INSERT INTO local_queue_times (timestamp, queue_time) VALUES (?,?)',
+                    (timestamp, queue_time)
+                )
+
+    def get_local_queue_times_since(self, time: float) -> Tuple[int]:
+        with self.conn:
+            cur = self.conn.execute(
+                'SELECT queue_time FROM local_queue_times WHERE timestamp >= (?)', (int(time),)
+            )
+            return tuple(int(r[0]) for r in cur.fetchall())
 
-    def get_queue_times(self) -> Tuple[Tuple[int, int, int, str, str]]:
+    def get_queue_times(self, limit: int = 0) -> Tuple[Tuple[int, int, int, str, str]]:
         with self.conn:
-            cur = self.conn.execute("SELECT rowid, timestamp, metric, source, metadata FROM logs ORDER BY timestamp ")
+            cur = self.conn.execute(
+                "SELECT rowid, timestamp, metric, source, metadata FROM logs ORDER BY timestamp LIMIT (?)",
+                (limit or -1,)
+            )
             return tuple((int(r[0]), int(r[1]), int(r[2]), str(r[3]), str(r[4])) for r in cur.fetchall())
 
     def delete_queue_times(self, row_ids: Iterable[int]):
@@ -70,6 +111,7 @@ class RequestLogRepository:
         self.logger.debug(f"delete_queue_times_before ({time})")
         with self.conn:
             self.conn.execute('DELETE FROM logs WHERE timestamp < (?)', (int(time),))
+            self.conn.execute('DELETE FROM local_queue_times WHERE timestamp < (?)', (int(time),))
         self.vacuum()
 
     def vacuum(self):
@@ -14,6 +14,7 @@ from requests import Request, PreparedRequest, Response, Session
 
 from dynoscale import __version__
 from dynoscale.logger import RequestLogRepository, DEFAULT_REQUEST_LOG_DB_FILENAME
+from dynoscale.runtime import RuntimeConfig
 
 logger = logging.getLogger(__name__)
 
@@ -54,6 +55,8 @@ class DynoscaleReporter:
         self.api_url = api_url
         self.report_period = report_period
         self.vacuum_period = vacuum_period
+        # Created here, in the master, so that workers forked later share it
+        self.runtime_config = RuntimeConfig(publish_frequency=report_period, vacuum_period=vacuum_period)
         self.repository_filename = repository_filename
         self.repository: Optional[RequestLogRepository] = None
 
@@ -97,8 +100,8 @@ class DynoscaleReporter:
         else:
             self.logger.debug(f"stop - no loop")
 
-    def _report_coro(self):
-        logs_with_ids = self.repository.get_queue_times()
+    async def _report_coro(self):
+        logs_with_ids = self.repository.get_queue_times(limit=self.runtime_config.report_batch_size)
         # If there is nothing to report, exit
         if not logs_with_ids:
             self.logger.debug(f"report_now - nothing to report")
@@ -108,16 +111,23 @@ class DynoscaleReporter:
         self.logger.debug(f"report_now - will report payload of length {len(logs)}")
         response = self.upload_payload(payload)
         if response and response.ok:
-            # {"config":{"publish_frequency":30}}
+            # {"config":{"publish_frequency":30, "vacuum_period":300, "sample_rate":1.0, "report_batch_size":0}}
             res_json = {}
             try:
                 res_json = response.json()
             except JSONDecodeError:
                 pass
-            if res_json:
-                self.report_period = res_json['config']['publish_frequency']
+            if isinstance(res_json, dict) and isinstance(res_json.get('config'), dict):
+                self.update_runtime_config(res_json['config'])
             self.repository.delete_queue_times(ids)
 
+    def update_runtime_config(self, config: dict):
+        changed = self.runtime_config.update(config)
+        if 'publish_frequency' in changed:
+            self.report_period = changed['publish_frequency']
+        if 'vacuum_period' in changed:
+            self.vacuum_period = changed['vacuum_period']
+
     def upload_payload(self, payload: str) -> Optional[Response]:
         self.logger.debug(f"upload_payload")
         if not payload:
@@ -0,0 +1,86 @@
+import logging
+import math
+from multiprocessing.sharedctypes import RawValue
+from typing import Any, Dict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_RATE = 1.0
+DEFAULT_REPORT_BATCH_SIZE = 0  # 0 means no limit
+
+# name: (type, minimum, maximum)
+PARAMETERS = {
+    'publish_frequency': (int, 1, 60 * 60),
+    'vacuum_period': (int, 10, 24 * 60 * 60),
+    # Not recording any requests at all would leave nothing to scale on
+    'sample_rate': (float, 0.01, 1.0),
+    'report_batch_size': (int, 0, 1_000_000),
+}
+_TYPECODES = {int: 'l', float: 'd'}
+
+
+class RuntimeConfig:
+    """Agent parameters the Dynoscale API can change without a restart.
+
+    Created in the master before workers are forked, so the values and their `generation` live in memory shared with
+    the workers. The master validates and writes new values and then bumps the generation, workers call `refresh()`
+    which only copies the values over when the generation changed."""
+
+    def __init__(
+            self,
+            publish_frequency: int,
+            vacuum_period: int,
+            sample_rate: float = DEFAULT_SAMPLE_RATE,
+            report_batch_size: int = DEFAULT_REPORT_BATCH_SIZE,
+    ):
+        self.logger: logging.Logger = logging.getLogger(f"{logger.name}.{RuntimeConfig.__name__}")
+        self.logger.debug(f"__init__")
+        self.publish_frequency = publish_frequency
+        self.vacuum_period = vacuum_period
+        self.sample_rate = sample_rate
+        self.report_batch_size = report_batch_size
+
+        self._shared = {
+            name: RawValue(_TYPECODES[type_], getattr(self, name)) for name, (type_, _, _) in PARAMETERS.items()
+        }
+        self._shared_generation = RawValue('L', 0)
+        self._generation = 0
+
+    @property
+    def generation(self) -> int:
+        return self._shared_generation.value
+
+    def update(self, values: Dict[str, Any]) -> Dict[str, Any]:
+        """Validates and applies values received from the API, returns those that changed"""
+        self.logger.debug(f"update ({values})")
+        changed = {}
+        for name, value in values.items():
+            if name not in PARAMETERS:
+                continue
+            type_, minimum, maximum = PARAMETERS[name]
+            # bool is an int too, but not a valid value for any of the parameters
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or \
+                    (type_ is int and value != int(value)) or not minimum <= value <= maximum:
+                self.logger.warning(f"update - ignoring invalid {name}: {value!r}")
+                continue
+            if type_(value) != getattr(self, name):
+                changed[name] = type_(value)
+        if changed:
+            for name, value in changed.items():
+                setattr(self, name, value)
+                self._shared[name].value = value
+            self._shared_generation.value += 1
+            self._generation = self._shared_generation.value
+            self.logger.info(f"update - generation {self._generation}: {changed}")
+        return changed
+
+    def refresh(self) -> bool:
+        """Picks up values the master changed, cheap enough to call on every request"""
+        generation = self._shared_generation.value
+        if generation == self._generation:
+            return False
+        for name, shared in self._shared.items():
+            setattr(self, name, shared.value)
+        self._generation = generation
+        self.logger.debug(f"refresh - generation {generation}")
+        return True
@@ -4,11 +4,14 @@ import os
 import random
 import threading
 import time
+from typing import Optional
 
 from dynoscale.const.header import X_REQUEST_START
 
 logger = logging.getLogger(__name__)
 
+CGROUP_ROOT = '/sys/fs/cgroup'
+
 
 # TODO: Decide if I should keep this for devs to test locally or remove
 def mock_in_heroku_headers(req):
@@ -69,3 +72,62 @@ def log_e(msg: str):
 
 def log_c(msg: str):
     logger.critical(msg=prepend_process_info(prepend_thread_info(msg)))
+
+
+def pss_bytes(pid: int) -> int:
+    """Proportional set size of a process in bytes, 0 if it can't be read.
+
+    Unlike RSS, pages shared with forked processes are split between them, so PSS of processes can be summed up."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as smaps:
+            for line in smaps:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+def _read_memory_stat(path: str, key: str) -> Optional[int]:
+    try:
+        with open(path) as stat_file:
+            for line in stat_file:
+                name, _, value = line.partition(' ')
+                if name == key:
+                    return int(value)
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def cgroup_memory_usage(root: str = CGROUP_ROOT) -> Optional[int]:
+    """Working set of the current cgroup (v2 or v1) in bytes, None if there isn't one.
+
+    Inactive page cache is left out, the kernel reclaims it before running out of memory."""
+    for usage_path, stat_path, inactive_key in (
+            (f"{root}/memory.current", f"{root}/memory.stat", 'inactive_file'),
+            (f"{root}/memory/memory.usage_in_bytes", f"{root}/memory/memory.stat", 'total_inactive_file'),
+    ):
+        try:
+            with open(usage_path) as usage_file:
+                value = usage_file.read().strip()
+        except OSError:
+            continue
+        if value.isdigit():
+            inactive = _read_memory_stat(stat_path, inactive_key) or 0
+            return max(int(value) - inactive, 0)
+    return None
+
+
+def cgroup_memory_limit(root: str = CGROUP_ROOT) -> Optional[int]:
+    """Memory limit of the current cgroup (v2 or v1) in bytes, None if there isn't one"""
+    for path in (f"{root}/memory.max", f"{root}/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as limit_file:
+                value = limit_file.read().strip()
+        except OSError:
+            continue
+        # cgroup v1 reports "no limit" as a huge number instead of "max"
+        if value.isdigit() and int(value) < 2 ** 60:
+            return int(value)
+    return None
@@ -0,0 +1,234 @@
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from multiprocessing.sharedctypes import RawValue
+from typing import Optional
+
+from dynoscale.logger import RequestLogRepository, DEFAULT_REQUEST_LOG_DB_FILENAME
+from dynoscale.runtime import RuntimeConfig
+from dynoscale.utils import epoch_s, epoch_ms, cgroup_memory_usage, pss_bytes
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SECONDS_BETWEEN_EVALUATIONS = 5
+DEFAULT_SECONDS_OF_METRICS_WINDOW = 10
+DEFAULT_SECONDS_OF_COOLDOWN = 15
+DEFAULT_SCALE_UP_QUEUE_TIME_MS = 200
+DEFAULT_SCALE_DOWN_QUEUE_TIME_MS = 20
+DEFAULT_SCALE_UP_UTILIZATION = 0.8
+DEFAULT_SCALE_DOWN_UTILIZATION = 0.3
+DEFAULT_EVALUATIONS_TO_SCALE_UP = 2
+DEFAULT_EVALUATIONS_TO_SCALE_DOWN = 6
+DEFAULT_MEMORY_HEADROOM = 0.9
+
+WORKERS_LOG_SOURCE = "workers"
+
+
+class BusyTime:
+    """Total time all workers spent serving requests in ms, including requests that are still being served.
+
+    Created in the master before workers are forked, so the counters live in memory shared with the workers.
+    Workers call `start` and `end` around every request, the master reads `total` to see how busy they were
+    between two points in time, even while requests run for longer than that."""
+
+    def __init__(self):
+        self._lock = multiprocessing.Lock()
+        self._completed = RawValue('Q', 0)
+        self._in_flight = RawValue('L', 0)
+        # Sum of start times of in-flight requests, so their busy time so far is `in_flight * now - started`
+        self._started = RawValue('Q', 0)
+
+    def start(self, now: int):
+        with self._lock:
+            self._in_flight.value += 1
+            self._started.value += now
+
+    def end(self, started: int, now: int):
+        with self._lock:
+            self._in_flight.value -= 1
+            self._started.value -= started
+            self._completed.value += now - started
+
+    def total(self, now: int) -> int:
+        with self._lock:
+            return self._completed.value + self._in_flight.value * now - self._started.value
+
+
+class WorkerScaler:
+    """Grows and shrinks the number of gunicorn workers in this dyno by signalling the master with TTIN/TTOU.
+
+    Runs in the master process. Workers record queue times into the shared repository as requests arrive and track
+    their busy time in `busy_time`. Every evaluation reads the queue times of the last `window` seconds and the busy
+    time since the previous evaluation and moves the worker count by at most one.
+    A change needs several consecutive evaluations agreeing on it and no other change within `cooldown`."""
+
+    def __init__(
+            self,
+            server,
+            min_workers: int,
+            max_workers: int,
+            evaluation_period: float = DEFAULT_SECONDS_BETWEEN_EVALUATIONS,
+            window: int = DEFAULT_SECONDS_OF_METRICS_WINDOW,
+            cooldown: float = DEFAULT_SECONDS_OF_COOLDOWN,
+            scale_up_queue_time: int = DEFAULT_SCALE_UP_QUEUE_TIME_MS,
+            scale_down_queue_time: int = DEFAULT_SCALE_DOWN_QUEUE_TIME_MS,
+            scale_up_utilization: float = DEFAULT_SCALE_UP_UTILIZATION,
+            scale_down_utilization: float = DEFAULT_SCALE_DOWN_UTILIZATION,
+            evaluations_to_scale_up: int = DEFAULT_EVALUATIONS_TO_SCALE_UP,
+            evaluations_to_scale_down: int = DEFAULT_EVALUATIONS_TO_SCALE_DOWN,
+            memory_limit: Optional[int] = None,
+            busy_time: Optional[BusyTime] = None,
+            runtime_config: Optional[RuntimeConfig] = None,
+            repository_filename: str = DEFAULT_REQUEST_LOG_DB_FILENAME
+    ):
+        self.logger: logging.Logger = logging.getLogger(f"{logger.name}.{WorkerScaler.__name__}")
+        self.logger.debug(f"__init__")
+        if not 1 <= min_workers <= max_workers:
+            raise ValueError(f"Expected 1 <= min_workers <= max_workers, got {min_workers} and {max_workers}")
+
+        self.server = server
+        self.workers: int = server.num_workers
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.evaluation_period = evaluation_period
+        self.window = window
+        self.cooldown = cooldown
+        self.scale_up_queue_time = scale_up_queue_time
+        self.scale_down_queue_time = scale_down_queue_time
+        self.scale_up_utilization = scale_up_utilization
+        self.scale_down_utilization = scale_down_utilization
+        self.evaluations_to_scale_up = evaluations_to_scale_up
+        self.evaluations_to_scale_down = evaluations_to_scale_down
+        self.memory_limit = memory_limit
+        self.busy_time = busy_time or BusyTime()
+        self.runtime_config = runtime_config
+        self.repository_filename = repository_filename
+        self.repository: Optional[RequestLogRepository] = None
+
+        self.scaler_thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._up_streak = 0
+        self._down_streak = 0
+        self._last_change: float = 0
+        self._busy_at = epoch_ms()
+        self._busy_total = self.busy_time.total(self._busy_at)
+
+    def on_workers_changed(self, workers: int):
+        self.logger.debug(f"on_workers_changed ({self.workers}->{workers})")
+        self.workers = workers
+
+    def memory_usage(self) -> int:
+        """Working set of the dyno's cgroup in bytes, or of the master and its workers if there's no cgroup"""
+        usage = cgroup_memory_usage()
+        if usage is not None:
+            return usage
+        # Workers share copy-on-write pages with the master, RSS would count those once per process
+        pids = [os.getpid(), *getattr(self.server, 'WORKERS', {}).keys()]
+        return sum(pss_bytes(pid) for pid in pids)
+
+    @property
+    def sample_rate(self) -> float:
+        return self.runtime_config.sample_rate if self.runtime_config else 1.0
+
+    def utilization(self) -> float:
+        """Fraction of the time since the previous call the workers spent serving requests"""
+        now = epoch_ms()
+        total = self.busy_time.total(now)
+        busy, elapsed = total - self._busy_total, now - self._busy_at
+        self._busy_at, self._busy_total = now, total
+        if elapsed <= 0:
+            return 0.0
+        return min(busy / (elapsed * max(self.workers, 1)), 1.0)
+
+    def decide(self, queue_time: float, utilization: float, memory_usage: int, now: float) -> int:
+        """Returns +1 to add a worker, -1 to remove one or 0 to keep the current count"""
+        if self.workers < self.min_workers:
+            return 1
+        if self.workers > self.max_workers:
+            return -1
+        cooling_down = now - self._last_change < self.cooldown
+        if self.memory_limit and memory_usage > self.memory_limit and self.workers > self.min_workers:
+            return 0 if cooling_down else -1
+
+        # High queue time on its own isn't enough, if the workers are idle another one won't help
+        if queue_time >= self.scale_up_queue_time and utilization >= self.scale_up_utilization:
+            self._up_streak += 1
+            self._down_streak = 0
+        elif queue_time <= self.scale_down_queue_time and utilization <= self.scale_down_utilization:
+            self._down_streak += 1
+            self._up_streak = 0
+        else:
+            self._up_streak = 0
+            self._down_streak = 0
+
+        if cooling_down:
+            return 0
+        if self._up_streak >= self.evaluations_to_scale_up and self.workers < self.max_workers:
+            # Assume a new worker will take as much memory as an average process in this dyno
+            per_process = memory_usage / (self.workers + 1)
+            if self.memory_limit and memory_usage + per_process > self.memory_limit:
+                self.logger.debug(f"decide - not adding a worker, memory limit would be exceeded")
+                return 0
+            return 1
+        if self._down_streak >= self.evaluations_to_scale_down and self.workers > self.min_workers:
+            return -1
+        return 0
+
+    def evaluate(self):
+        self.logger.debug(f"evaluate")
+        since = epoch_s() - self.window
+        utilization = self.utilization()
+        # Read from local copies rather than logs, logs are deleted once they are reported
+        queue_times = self.repository.get_local_queue_times_since(since)
+        if not queue_times and self.sample_rate < 1:
+            # With sampling, an empty window doesn't mean the dyno is idle
+            self.logger.debug(f"evaluate - no sampled requests, keeping {self.workers} workers")
+            return
+        queue_time = sum(queue_times) / len(queue_times) if queue_times else 0
+        memory_usage = self.memory_usage()
+        self.logger.debug(
+            f"evaluate - workers:{self.workers} queue_time:{queue_time:.0f}ms "
+            f"utilization:{utilization:.2f} memory:{memory_usage}B"
+        )
+        change = self.decide(queue_time, utilization, memory_usage, time.monotonic())
+        if change:
+            self.scale(change)
+
+    def scale(self, change: int):
+        target = self.workers + change
+        self.logger.info(f"scale - {self.workers}->{target} workers")
+        os.kill(self.server.pid, signal.SIGTTIN if change > 0 else signal.SIGTTOU)
+        self.repository.add_log(epoch_s(), target, WORKERS_LOG_SOURCE, "ttin" if change > 0 else "ttou")
+        self._last_change = time.monotonic()
+        self._up_streak = 0
+        self._down_streak = 0
+        # nworkers_changed will confirm this once the master handles the signal
+        self.workers = target
+
+    def start(self):
+        """Evaluates on its own thread, so that a slow report upload never holds scaling back"""
+        self.logger.debug(f"start")
+        self._stopped.clear()
+        self.scaler_thread = threading.Thread(target=self._scaling_loop, name='dynoscale-worker-scaler', daemon=True)
+        self.scaler_thread.start()
+
+    def stop(self):
+        self.logger.debug(f"stop")
+        self._stopped.set()
+        if self.scaler_thread and self.scaler_thread.is_alive():
+            self.scaler_thread.join()
+        self.scaler_thread = None
+
+    def _scaling_loop(self):
+        self.logger.debug(f"_scaling_loop")
+        # sqlite connections can only be used from the thread that opened them
+        self.repository = RequestLogRepository(filename=self.repository_filename)
+        while not self._stopped.wait(self.evaluation_period):
+            try:
+                self.evaluate()
+            except Exception:
+                self.logger.exception(f"_scaling_loop - evaluation failed")
+        self.logger.debug(f"_scaling_loop - stopped")
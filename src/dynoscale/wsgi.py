@@ -0,0 +1,85 @@
+import logging
+import threading
+from typing import Iterable, Optional, Callable
+
+from dynoscale.utils import epoch_ms
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SECONDS_OF_RETRY_AFTER = 5
+
+SHED_LOG_SOURCE = "shed"
+WSGI_X_REQUEST_START = 'HTTP_X_REQUEST_START'
+
+
+class LoadSheddingMiddleware:
+    """WSGI middleware rejecting requests that waited in the queue longer than clients will wait for a response.
+
+    Such requests are answered with 503 and `Retry-After` right away instead of tying up a worker, requests to paths
+    starting with any of `exempt_paths` are always served. Number of rejected requests per second is handed to
+    `on_shed` (timestamp, count) when the second is over, or on `flush()`. Without `on_shed` the counts are dropped."""
+
+    def __init__(
+            self,
+            app,
+            deadline: int,
+            retry_after: int = DEFAULT_SECONDS_OF_RETRY_AFTER,
+            exempt_paths: Iterable[str] = (),
+            on_shed: Optional[Callable[[int, int], None]] = None,
+    ):
+        self.logger: logging.Logger = logging.getLogger(f"{logger.name}.{LoadSheddingMiddleware.__name__}")
+        self.logger.debug(f"__init__")
+        self.app = app
+        self.deadline = deadline
+        self.retry_after = retry_after
+        self.exempt_paths = tuple(exempt_paths)
+        self.on_shed = on_shed
+
+        self._shed_second: int = 0
+        self._shed_count: int = 0
+        # gthread workers call the app from several threads
+        self._shed_lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        now = epoch_ms()
+        self._flush(now // 1_000)
+        x_request_start = environ.get(WSGI_X_REQUEST_START)
+        if not x_request_start or environ.get('PATH_INFO', '').startswith(self.exempt_paths):
+            return self.app(environ, start_response)
+        try:
+            queue_time = now - int(x_request_start)
+        except ValueError:
+            return self.app(environ, start_response)
+        if queue_time <= self.deadline:
+            return self.app(environ, start_response)
+
+        self.logger.debug(f"__call__ - shedding request, queue time {queue_time}ms")
+        with self._shed_lock:
+            self._shed_second = now // 1_000
+            self._shed_count += 1
+        start_response('503 Service Unavailable', [
+            ('Content-Type', 'text/plain'),
+            ('Content-Length', '0'),
+            ('Retry-After', str(self.retry_after)),
+        ])
+        return [b'']
+
+    def flush(self):
+        """Hands over the pending shed count right away, call it before the worker exits"""
+        with self._shed_lock:
+            shed_second, shed_count = self._shed_second, self._shed_count
+            self._shed_count = 0
+        if shed_count and self.on_shed:
+            self.on_shed(shed_second, shed_count)
+
+    def _flush(self, second: int):
+        """Hands over the shed count once its second is over, so there's at most one record per second"""
+        if not self._shed_count or second == self._shed_second:
+            return
+        with self._shed_lock:
+            if not self._shed_count or second == self._shed_second:
+                return
+            shed_second, shed_count = self._shed_second, self._shed_count
+            self._shed_count = 0
+        if self.on_shed:
+            self.on_shed(shed_second, shed_count)
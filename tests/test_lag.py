@@ -0,0 +1,162 @@
+import asyncio
+import sys
+import time
+import types
+
+import pytest
+
+from dynoscale.agent import DynoscaleAgent
+from dynoscale.lag import LoopLagSampler, AsyncioLoopLagSampler, GeventHubLagSampler, percentile
+
+
+@pytest.fixture
+def windows():
+    return []
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, .5) == 50
+    assert percentile(values, .99) == 99
+    assert percentile([7], .99) == 7
+
+
+def test_sample_reports_once_per_window(windows):
+    sampler = LoopLagSampler(lambda *window: windows.append(window[1:]), interval=1, window=10)
+    sampler._reset(0)
+    # 9 callbacks on time, 1 of them 500ms late
+    for now in (1, 2, 3, 4, 5.5, 6.5, 7.5, 8.5, 9.5):
+        sampler.sample(now)
+    assert windows == []
+
+    sampler.sample(10.5)
+    assert windows == [(0, 500, 500)]
+    assert sampler._lags == []
+
+
+@pytest.mark.asyncio
+async def test_asyncio_sampler_measures_blocked_loop(windows):
+    loop = asyncio.get_running_loop()
+    sampler = AsyncioLoopLagSampler(loop, lambda *window: windows.append(window[1:]), interval=.01, window=.2)
+    sampler.start()
+    await asyncio.sleep(.05)
+    # Block the loop
+    time.sleep(.1)
+    await asyncio.sleep(.2)
+    sampler.stop()
+
+    assert windows
+    p50, p99, maximum = windows[0]
+    assert p50 < 50
+    assert maximum >= 80
+
+
+class FakeTimer:
+    def __init__(self, after, repeat, ref=True):
+        self.after = after
+        self.repeat = repeat
+        self.ref = ref
+        self.callback = None
+
+    def start(self, callback):
+        self.callback = callback
+
+    def stop(self):
+        self.callback = None
+
+
+class FakeHub:
+    def __init__(self):
+        self.loop = self
+        self.timers = []
+
+    def timer(self, after, repeat, ref=True):
+        self.timers.append(FakeTimer(after, repeat, ref))
+        return self.timers[-1]
+
+
+def test_gevent_sampler_uses_one_unreferenced_repeating_timer(windows):
+    hub = FakeHub()
+    sampler = GeventHubLagSampler(hub, lambda *window: windows.append(window[1:]), interval=.5, window=0)
+    sampler.start()
+
+    assert len(hub.timers) == 1
+    timer = hub.timers[0]
+    assert (timer.after, timer.repeat, timer.ref) == (.5, .5, False)
+
+    sampler._expected = time.monotonic() - .25
+    timer.callback()
+    assert len(windows) == 1
+    p50, p99, maximum = windows[0]
+    assert 250 <= maximum < 1_000
+
+    sampler.stop()
+    assert timer.callback is None
+
+
+class GeventWorker:
+    pass
+
+
+GeventWorker.__module__ = 'gunicorn.workers.ggevent'
+
+
+class CustomGeventWorker(GeventWorker):
+    pid = 1
+
+
+class UvicornWorker:
+    pid = 1
+
+    async def _serve(self):
+        agent = DynoscaleAgent()
+        return isinstance(agent.loop_lag_sampler, AsyncioLoopLagSampler) and agent.loop_lag_sampler._handle is not None
+
+
+UvicornWorker.__module__ = 'uvicorn.workers'
+
+
+class OldUvicornWorker:
+    pid = 1
+
+
+OldUvicornWorker.__module__ = 'uvicorn.workers'
+
+
+class FakeEventLogger:
+    def on_loop_lag(self, timestamp, p50, p99, maximum):
+        pass
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    ds_agent = DynoscaleAgent()
+    monkeypatch.setattr(ds_agent, 'event_logger', FakeEventLogger(), raising=False)
+    monkeypatch.setattr(ds_agent, 'loop_lag_sampler', None)
+    return ds_agent
+
+
+def test_agent_installs_gevent_sampler_for_subclasses(agent, monkeypatch):
+    hub = FakeHub()
+    monkeypatch.setitem(sys.modules, 'gevent', types.SimpleNamespace(get_hub=lambda: hub))
+
+    agent.install_loop_lag_sampler(CustomGeventWorker())
+
+    assert isinstance(agent.loop_lag_sampler, GeventHubLagSampler)
+    assert agent.loop_lag_sampler.hub is hub
+    assert hub.timers[0].callback is not None
+    agent.loop_lag_sampler.stop()
+
+
+def test_agent_starts_asyncio_sampler_once_uvicorn_serves(agent):
+    worker = UvicornWorker()
+    agent.install_loop_lag_sampler(worker)
+    assert agent.loop_lag_sampler is None
+
+    assert asyncio.run(worker._serve()) is True
+    agent.loop_lag_sampler.stop()
+
+
+def test_agent_skips_uvicorn_without_serve(agent):
+    agent.install_loop_lag_sampler(OldUvicornWorker())
+    assert agent.loop_lag_sampler is None
@@ -164,3 +164,17 @@ async def test_update_publish_frequency(mocked_responses, ds_log_repository, ds_
     assert mocked_responses.calls[0].request.body == payload
     assert mocked_responses.calls[0].response.json() == resp_json
     assert ds_reporter.report_period == publish_frequency
+
+
+def test_update_runtime_config(ds_reporter):
+    ds_reporter.update_runtime_config({
+        'publish_frequency': 15,
+        'vacuum_period': 600,
+        'sample_rate': 0.5,
+        'report_batch_size': 'all',
+    })
+
+    assert ds_reporter.report_period == 15
+    assert ds_reporter.vacuum_period == 600
+    assert ds_reporter.runtime_config.sample_rate == 0.5
+    assert ds_reporter.runtime_config.report_batch_size == 0
@@ -0,0 +1,86 @@
+import multiprocessing
+import sys
+
+import pytest
+
+from dynoscale.runtime import RuntimeConfig
+
+
+@pytest.fixture
+def runtime_config():
+    return RuntimeConfig(publish_frequency=30, vacuum_period=300)
+
+
+def test_runtime_config_defaults(runtime_config):
+    assert runtime_config.publish_frequency == 30
+    assert runtime_config.vacuum_period == 300
+    assert runtime_config.sample_rate == 1.0
+    assert runtime_config.report_batch_size == 0
+    assert runtime_config.generation == 0
+
+
+def test_update_returns_changed_values(runtime_config):
+    changed = runtime_config.update({'publish_frequency': 30, 'sample_rate': 0.25, 'unknown': 1})
+    assert changed == {'sample_rate': 0.25}
+    assert runtime_config.sample_rate == 0.25
+    assert runtime_config.generation == 1
+
+
+def test_update_without_changes_keeps_generation(runtime_config):
+    assert runtime_config.update({'publish_frequency': 30}) == {}
+    assert runtime_config.generation == 0
+
+
+@pytest.mark.parametrize('name,value', [
+    ('publish_frequency', 0),
+    ('publish_frequency', 1.5),
+    ('publish_frequency', '60'),
+    ('publish_frequency', True),
+    ('publish_frequency', float('inf')),
+    ('publish_frequency', float('nan')),
+    ('sample_rate', float('nan')),
+    ('report_batch_size', float('-inf')),
+    ('vacuum_period', None),
+    ('sample_rate', 0),
+    ('sample_rate', 1.1),
+    ('sample_rate', -0.1),
+    ('report_batch_size', -1),
+])
+def test_update_ignores_invalid_values(runtime_config, name, value):
+    before = getattr(runtime_config, name)
+    assert runtime_config.update({name: value}) == {}
+    assert getattr(runtime_config, name) == before
+
+
+def test_update_coerces_types(runtime_config):
+    runtime_config.update({'sample_rate': 0.5})
+    assert runtime_config.update({'publish_frequency': 60.0, 'sample_rate': 1}) == {
+        'publish_frequency': 60,
+        'sample_rate': 1.0,
+    }
+    assert isinstance(runtime_config.publish_frequency, int)
+    assert isinstance(runtime_config.sample_rate, float)
+
+
+def _refresh_after_update(runtime_config, ready, updated, queue):
+    unchanged = runtime_config.refresh()
+    ready.set()
+    updated.wait(timeout=5)
+    queue.put((unchanged, runtime_config.refresh(), runtime_config.sample_rate, runtime_config.refresh()))
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="workers are forked")
+def test_forked_worker_picks_up_update(runtime_config):
+    context = multiprocessing.get_context('fork')
+    ready = context.Event()
+    updated = context.Event()
+    queue = context.Queue()
+    worker = context.Process(target=_refresh_after_update, args=(runtime_config, ready, updated, queue))
+    worker.start()
+    assert ready.wait(timeout=5)
+
+    runtime_config.update({'sample_rate': 0.1})
+    updated.set()
+
+    assert queue.get(timeout=5) == (False, True, 0.1, False)
+    worker.join()
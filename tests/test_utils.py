@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+from dynoscale.utils import cgroup_memory_usage, cgroup_memory_limit
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'cgroup')
+
+
+@pytest.mark.parametrize('version,usage', [
+    # memory.current less inactive_file
+    ('v2', 536_870_912 - 201_326_592),
+    # memory.usage_in_bytes less total_inactive_file, not the cgroup's own inactive_file
+    ('v1', 536_870_912 - 134_217_728),
+])
+def test_cgroup_memory_usage_is_working_set(version, usage):
+    assert cgroup_memory_usage(os.path.join(FIXTURES, version)) == usage
+
+
+def test_cgroup_memory_usage_without_cgroup(tmp_path):
+    assert cgroup_memory_usage(str(tmp_path)) is None
+
+
+def test_cgroup_memory_usage_without_stat(tmp_path):
+    (tmp_path / 'memory.current').write_text('1024\n')
+    assert cgroup_memory_usage(str(tmp_path)) == 1024
+
+
+def test_cgroup_memory_limit():
+    assert cgroup_memory_limit(os.path.join(FIXTURES, 'v2')) == 1_073_741_824
+    # cgroup v1 reports no limit as a huge number
+    assert cgroup_memory_limit(os.path.join(FIXTURES, 'v1')) is None
@@ -0,0 +1,274 @@
+import asyncio
+import contextlib
+import os
+import signal
+import time
+
+import pytest
+
+from dynoscale.logger import RequestLogRepository
+from dynoscale.reporter import DynoscaleReporter
+from dynoscale.runtime import RuntimeConfig
+from dynoscale.utils import epoch_s
+from dynoscale.workers import WorkerScaler, BusyTime, WORKERS_LOG_SOURCE
+
+REPOSITORY_FILENAME = "dynoscale_test_workers_repo.sqlite3"
+
+
+class FakeServer:
+    def __init__(self, num_workers: int):
+        self.pid = 12345
+        self.num_workers = num_workers
+        self.WORKERS = {}
+
+
+@pytest.fixture
+def ds_log_repository():
+    request_log_repository = RequestLogRepository(
+        filename=REPOSITORY_FILENAME
+    )
+    yield request_log_repository
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(REPOSITORY_FILENAME)
+
+
+@pytest.fixture
+def signals(monkeypatch):
+    sent = []
+    monkeypatch.setattr(os, 'kill', lambda pid, sig: sent.append((pid, sig)))
+    return sent
+
+
+class Clock:
+    def __init__(self):
+        self.ms = epoch_s() * 1_000
+
+    def epoch_ms(self) -> int:
+        return self.ms
+
+    def epoch_s(self) -> int:
+        return self.ms // 1_000
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = Clock()
+    monkeypatch.setattr('dynoscale.workers.epoch_ms', fake_clock.epoch_ms)
+    monkeypatch.setattr('dynoscale.workers.epoch_s', fake_clock.epoch_s)
+    return fake_clock
+
+
+def make_scaler(num_workers: int = 2, **kwargs) -> WorkerScaler:
+    kwargs.setdefault('min_workers', 1)
+    kwargs.setdefault('max_workers', 4)
+    kwargs.setdefault('cooldown', 0)
+    return WorkerScaler(server=FakeServer(num_workers), **kwargs)
+
+
+def test_scaler_construction():
+    with pytest.raises(ValueError):
+        make_scaler(min_workers=3, max_workers=2)
+    with pytest.raises(ValueError):
+        make_scaler(min_workers=0)
+
+    scaler = make_scaler(num_workers=3)
+    assert scaler.workers == 3
+
+
+def test_scale_up_needs_consecutive_evaluations():
+    scaler = make_scaler(evaluations_to_scale_up=2)
+    assert scaler.decide(queue_time=500, utilization=0.9, memory_usage=0, now=100) == 0
+    assert scaler.decide(queue_time=500, utilization=0.9, memory_usage=0, now=101) == 1
+
+
+def test_hysteresis_resets_streak():
+    scaler = make_scaler(evaluations_to_scale_up=2)
+    assert scaler.decide(queue_time=500, utilization=0.9, memory_usage=0, now=100) == 0
+    # Somewhere between the thresholds, neither scale up nor down
+    assert scaler.decide(queue_time=100, utilization=0.5, memory_usage=0, now=101) == 0
+    assert scaler.decide(queue_time=500, utilization=0.9, memory_usage=0, now=102) == 0
+
+
+def test_idle_workers_do_not_scale_up():
+    scaler = make_scaler(evaluations_to_scale_up=1)
+    assert scaler.decide(queue_time=500, utilization=0.1, memory_usage=0, now=100) == 0
+
+
+def test_scale_down_within_bounds():
+    scaler = make_scaler(num_workers=2, evaluations_to_scale_down=1)
+    assert scaler.decide(queue_time=0, utilization=0, memory_usage=0, now=100) == -1
+    scaler.on_workers_changed(1)
+    assert scaler.decide(queue_time=0, utilization=0, memory_usage=0, now=101) == 0
+
+
+def test_scale_up_within_bounds():
+    scaler = make_scaler(num_workers=4, evaluations_to_scale_up=1)
+    assert scaler.decide(queue_time=500, utilization=0.9, memory_usage=0, now=100) == 0
+
+
+def test_out_of_bounds_is_corrected():
+    assert make_scaler(num_workers=1, min_workers=2).decide(0, 0, 0, now=100) == 1
+    assert make_scaler(num_workers=5, max_workers=4).decide(500, 1, 0, now=100) == -1
+
+
+def test_cooldown():
+    scaler = make_scaler(evaluations_to_scale_up=1, cooldown=10)
+    scaler._last_change = 100
+    assert scaler.decide(queue_time=500, utilization=0.9, memory_usage=0, now=105) == 0
+    assert scaler.decide(queue_time=500, utilization=0.9, memory_usage=0, now=110) == 1
+
+
+def test_memory_guard():
+    scaler = make_scaler(num_workers=2, evaluations_to_scale_up=1, memory_limit=1000)
+    # 3 processes at 300B each, a 4th one would go over the limit
+    assert scaler.decide(queue_time=500, utilization=0.9, memory_usage=900, now=100) == 0
+    assert scaler.decide(queue_time=500, utilization=0.9, memory_usage=1100, now=101) == -1
+
+
+def test_memory_guard_respects_cooldown():
+    scaler = make_scaler(num_workers=3, memory_limit=1000, cooldown=10)
+    scaler._last_change = 100
+    assert scaler.decide(queue_time=0, utilization=0, memory_usage=1100, now=105) == 0
+    assert scaler.decide(queue_time=0, utilization=0, memory_usage=1100, now=110) == -1
+
+
+def test_memory_usage_prefers_cgroup(monkeypatch):
+    monkeypatch.setattr('dynoscale.workers.cgroup_memory_usage', lambda: 1234)
+    assert make_scaler().memory_usage() == 1234
+
+    monkeypatch.setattr('dynoscale.workers.cgroup_memory_usage', lambda: None)
+    monkeypatch.setattr('dynoscale.workers.pss_bytes', lambda pid: 100)
+    scaler = make_scaler()
+    scaler.server.WORKERS = {1: None, 2: None}
+    assert scaler.memory_usage() == 300
+
+
+def test_busy_time_includes_requests_in_flight():
+    busy_time = BusyTime()
+    busy_time.start(1_000)
+    busy_time.start(2_000)
+    assert busy_time.total(3_000) == 3_000
+    busy_time.end(1_000, 4_000)
+    assert busy_time.total(5_000) == 3_000 + 3_000
+    busy_time.end(2_000, 5_000)
+    assert busy_time.total(9_000) == 6_000
+
+
+def test_utilization(clock):
+    scaler = make_scaler(num_workers=2)
+    assert scaler.utilization() == 0
+
+    clock.ms += 10_000
+    assert scaler.utilization() == 0
+
+    scaler.busy_time.start(clock.ms)
+    clock.ms += 10_000
+    assert scaler.utilization() == 0.5
+
+    scaler.busy_time.start(clock.ms)
+    clock.ms += 10_000
+    assert scaler.utilization() == 1
+
+
+def test_evaluate_signals_master_and_reports(ds_log_repository, signals, clock):
+    scaler = make_scaler(num_workers=1, evaluations_to_scale_up=1, repository_filename=REPOSITORY_FILENAME)
+    scaler.repository = ds_log_repository
+    scaler.busy_time.start(clock.ms)
+    ds_log_repository.add_queue_time(clock.epoch_s(), 1_000, keep_local=True)
+    clock.ms += 5_000
+
+    scaler.evaluate()
+
+    assert signals == [(12345, signal.SIGTTIN)]
+    assert scaler.workers == 2
+    logs = [log for log in ds_log_repository.get_queue_times() if log[3] == WORKERS_LOG_SOURCE]
+    assert [(log[2], log[4]) for log in logs] == [(2, "ttin")]
+
+
+class OkResponse:
+    ok = True
+
+    @staticmethod
+    def json():
+        return {'config': {'publish_frequency': 1}}
+
+
+def test_evaluate_after_report_still_scales_up(ds_log_repository, signals, monkeypatch, clock):
+    scaler = make_scaler(num_workers=2, evaluations_to_scale_up=1, repository_filename=REPOSITORY_FILENAME)
+    scaler.repository = ds_log_repository
+    for _ in range(20):
+        ds_log_repository.add_queue_time(clock.epoch_s(), 1_000, keep_local=True)
+    scaler.busy_time.start(clock.ms)
+    scaler.busy_time.start(clock.ms)
+    clock.ms += 5_000
+
+    reporter = DynoscaleReporter(api_url='', repository_filename=REPOSITORY_FILENAME)
+    reporter.repository = ds_log_repository
+    monkeypatch.setattr(reporter, 'upload_payload', lambda payload: OkResponse())
+    asyncio.run(reporter._report_coro())
+    assert ds_log_repository.get_queue_times() == ()
+
+    scaler.evaluate()
+
+    assert signals == [(12345, signal.SIGTTIN)]
+
+
+def test_evaluate_holds_without_samples(ds_log_repository, signals, clock):
+    runtime_config = RuntimeConfig(publish_frequency=30, vacuum_period=300, sample_rate=0.01)
+    scaler = make_scaler(num_workers=3, evaluations_to_scale_down=1, runtime_config=runtime_config)
+    scaler.repository = ds_log_repository
+
+    scaler.evaluate()
+
+    assert signals == []
+    assert scaler.workers == 3
+
+    # Without sampling an empty window really means there's no traffic
+    runtime_config.update({'sample_rate': 1.0})
+    scaler.evaluate()
+
+    assert signals == [(12345, signal.SIGTTOU)]
+
+
+def test_busy_with_long_requests_is_never_shrunk(ds_log_repository, signals, clock):
+    scaler = make_scaler(
+        num_workers=2, min_workers=1, max_workers=2, evaluations_to_scale_down=1, evaluation_period=5,
+        repository_filename=REPOSITORY_FILENAME,
+    )
+    scaler.repository = ds_log_repository
+    # Both workers serve back to back 15s requests, each of which queued for 2s
+    started = []
+    for _ in range(2):
+        ds_log_repository.add_queue_time(clock.epoch_s(), 2_000, keep_local=True)
+        scaler.busy_time.start(clock.ms)
+        started.append(clock.ms)
+
+    for _ in range(12):
+        clock.ms += 5_000
+        for i, start in enumerate(started):
+            if clock.ms - start >= 15_000:
+                scaler.busy_time.end(start, clock.ms)
+                ds_log_repository.add_queue_time(clock.epoch_s(), 2_000, keep_local=True)
+                scaler.busy_time.start(clock.ms)
+                started[i] = clock.ms
+        scaler.evaluate()
+
+    assert (12345, signal.SIGTTOU) not in signals
+
+
+def test_scaler_runs_on_its_own_thread(signals):
+    scaler = make_scaler(num_workers=1, min_workers=2, evaluation_period=.01, repository_filename=REPOSITORY_FILENAME)
+    try:
+        scaler.start()
+        assert scaler.scaler_thread.name == 'dynoscale-worker-scaler'
+        for _ in range(100):
+            if signals:
+                break
+            time.sleep(.01)
+    finally:
+        scaler.stop()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(REPOSITORY_FILENAME)
+
+    assert signals[0] == (12345, signal.SIGTTIN)
+    assert scaler.scaler_thread is None
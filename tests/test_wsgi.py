@@ -0,0 +1,104 @@
+import pytest
+
+from dynoscale.utils import epoch_ms
+from dynoscale.wsgi import LoadSheddingMiddleware, WSGI_X_REQUEST_START
+
+
+def app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'OK']
+
+
+class StartResponse:
+    def __init__(self):
+        self.status = None
+        self.headers = None
+
+    def __call__(self, status, headers):
+        self.status = status
+        self.headers = dict(headers)
+
+
+@pytest.fixture
+def shed():
+    return []
+
+
+@pytest.fixture
+def middleware(shed):
+    return LoadSheddingMiddleware(
+        app,
+        deadline=1_000,
+        retry_after=3,
+        exempt_paths=['/health'],
+        on_shed=lambda timestamp, count: shed.append((timestamp, count)),
+    )
+
+
+def call(middleware, queue_time=None, path='/'):
+    environ = {'PATH_INFO': path}
+    if queue_time is not None:
+        environ[WSGI_X_REQUEST_START] = str(epoch_ms() - queue_time)
+    start_response = StartResponse()
+    body = middleware(environ, start_response)
+    return start_response, body
+
+
+def test_serves_requests_within_deadline(middleware):
+    start_response, body = call(middleware, queue_time=10)
+    assert start_response.status == '200 OK'
+    assert body == [b'OK']
+
+
+def test_serves_requests_without_request_start(middleware):
+    start_response, _ = call(middleware)
+    assert start_response.status == '200 OK'
+
+
+def test_serves_requests_with_malformed_request_start(middleware):
+    start_response = StartResponse()
+    middleware({'PATH_INFO': '/', WSGI_X_REQUEST_START: 'garbage'}, start_response)
+    assert start_response.status == '200 OK'
+
+
+def test_sheds_requests_past_deadline(middleware):
+    start_response, body = call(middleware, queue_time=5_000)
+    assert start_response.status == '503 Service Unavailable'
+    assert start_response.headers['Retry-After'] == '3'
+    assert body == [b'']
+
+
+def test_exempt_paths_are_served(middleware):
+    start_response, _ = call(middleware, queue_time=5_000, path='/health/db')
+    assert start_response.status == '200 OK'
+
+
+def test_shed_counts_are_aggregated_per_second(middleware, shed):
+    call(middleware, queue_time=5_000)
+    call(middleware, queue_time=5_000)
+    assert shed == []
+
+    # Pretend the second those requests were shed in is over
+    middleware._shed_second -= 1
+    second = middleware._shed_second
+    call(middleware, queue_time=10)
+    assert shed == [(second, 2)]
+    call(middleware, queue_time=10)
+    assert shed == [(second, 2)]
+
+
+def test_flush_hands_over_pending_count(middleware, shed):
+    call(middleware, queue_time=5_000)
+    second = middleware._shed_second
+
+    middleware.flush()
+    middleware.flush()
+
+    assert shed == [(second, 1)]
+
+
+def test_shed_counts_are_dropped_without_on_shed():
+    middleware = LoadSheddingMiddleware(app, deadline=1_000)
+    start_response, _ = call(middleware, queue_time=5_000)
+    assert start_response.status == '503 Service Unavailable'
+    middleware.flush()